@@ -12,13 +12,17 @@
 .. moduleauthor:: Curtis Castrapel <ccastrapel@netflix.com>
 .. moduleauthor:: Mathias Petermann <mathias.petermann@projektfokus.ch>
 """
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 import json
+import threading
 import time
 
 import OpenSSL.crypto
 import josepy as jose
+import dns.name
 import dns.resolver
+import requests
 from acme import challenges, errors, messages
 from acme.client import BackwardsCompatibleClientV2, ClientNetwork
 from acme.errors import TimeoutError
@@ -34,10 +38,208 @@ from lemur.extensions import metrics
 
 from lemur.plugins.lemur_acme import cloudflare, dyn, route53, ultradns, powerdns, nsone
 from lemur.authorities import service as authorities_service
-from retrying import retry
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random
 
 from lemur.common.utils import data_encrypt, data_decrypt, is_json
 
+try:
+    # orjson parses several times faster than the json module, use it when it is installed
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+_PROVIDER_TYPES = {
+    "cloudflare": cloudflare,
+    "dyn": dyn,
+    "route53": route53,
+    "ultradns": ultradns,
+    "powerdns": powerdns,
+    "nsone": nsone
+}
+
+# Idle clients of reused ACME accounts by (directory url, account key thumbprint, registration), kept for the process
+# lifetime to save the directory fetch and TLS handshake of setting up a new client for every issuance. The acme client
+# is not thread-safe, so an issuance takes its client out of the cache, and only puts it back once it succeeded.
+_ACME_CLIENT_CACHE = {}
+
+# These providers publish the whole zone on every change, so none of their changes may interleave.
+_ZONE_PUBLISHING_PROVIDER_TYPES = {"dyn"}
+
+
+def _change_lock_key(provider_type, host):
+    """
+    Returns the key of the lock serializing conflicting TXT record changes. Providers read and rewrite the whole
+    record set of a name, so changes for the same name (e.g. a domain and its wildcard) must not interleave.
+    """
+    if provider_type in _ZONE_PUBLISHING_PROVIDER_TYPES:
+        return provider_type
+    return provider_type, host
+
+
+def _run_concurrently(func, arg_tuples):
+    """
+    Calls func(*args) for every entry of arg_tuples on a thread pool and returns the futures in submission order,
+    once all of them are done. Every call runs inside the current Flask app context.
+    """
+    app = current_app._get_current_object()
+    max_workers = max(1, min(current_app.config.get("ACME_MAX_WORKERS", 16), len(arg_tuples)))
+
+    def call(args):
+        with app.app_context():
+            return func(*args)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [executor.submit(call, args) for args in arg_tuples]
+
+
+# Seconds to back off between lookups while waiting for challenge TXT records to become visible
+_TXT_RECORD_POLL_DELAYS = (0.2, 0.4, 0.8, 1.6, 3.2)
+
+# Seconds after which waiting for challenge TXT records gives up, lookups included
+_TXT_RECORD_POLL_TIMEOUT = 5
+
+# Seconds a single visibility check of a TXT record may take, lookups of the name servers included
+_TXT_RECORD_CHECK_TIMEOUT = 2
+
+# Seconds a TXT record found visible is remembered, so that concurrent and repeated checks don't query DNS again
+_VISIBLE_TXT_RECORD_TTL = 60
+_visible_txt_records = {}
+
+# Seconds the authoritative name server addresses for the parent of a record name are remembered, so that repeated
+# checks only repeat the TXT queries
+_ZONE_NAMESERVERS_TTL = 300
+_zone_nameservers = {}
+
+
+def _cache_get(cache, key):
+    """Returns the value of a cache entry added with _cache_set, or None if it is missing or expired"""
+    expires, value = cache.get(key, (0, None))
+    if expires > time.monotonic():
+        return value
+    return None
+
+
+def _cache_set(cache, key, value, ttl):
+    """Adds an entry that expires after ttl seconds to a cache, dropping the entries that already expired"""
+    now = time.monotonic()
+    for cached_key, (expires, _) in list(cache.items()):
+        if expires <= now:
+            cache.pop(cached_key, None)
+    cache[key] = (now + ttl, value)
+
+
+def _resolver(deadline, nameserver=None):
+    """
+    Returns a resolver that gives up at deadline, a time.monotonic() value. It asks nameserver if given, and the
+    resolvers of the system otherwise.
+    """
+    lifetime = deadline - time.monotonic()
+    if lifetime <= 0:
+        raise dns.exception.Timeout()
+    resolver = dns.resolver.Resolver(configure=nameserver is None)
+    if nameserver:
+        resolver.nameservers = [nameserver]
+    resolver.lifetime = lifetime
+    return resolver
+
+
+def _authoritative_nameservers(name, deadline):
+    """
+    Returns the addresses of the authoritative name servers of the zone that name belongs to. The zone is looked up
+    through the system resolvers starting from the parent of name, so that name itself is never sent to them.
+    """
+    parent = dns.name.from_text(name).parent()
+    addresses = _cache_get(_zone_nameservers, parent)
+    if addresses is not None:
+        return addresses
+
+    zone = dns.resolver.zone_for_name(parent, resolver=_resolver(deadline))
+    addresses = []
+    for ns in _resolver(deadline).query(zone, "NS"):
+        addresses.extend(a.address for a in _resolver(deadline).query(ns.target, "A"))
+    _cache_set(_zone_nameservers, parent, addresses, _ZONE_NAMESERVERS_TTL)
+    return addresses
+
+
+def _txt_record_on_nameserver(name, value, nameserver, deadline):
+    answers = _resolver(deadline, nameserver).query(name, "TXT")
+    return any(value.encode() in rdata.strings for rdata in answers)
+
+
+def _txt_record_visible(name, value, deadline=None):
+    """
+    Returns whether the TXT records of name include value on every authoritative name server of the zone holding
+    name, which catches name servers that did not pick up the change yet. Recursive resolvers are only asked for name
+    when configured in ACME_PUBLIC_RESOLVERS, as asking them before the record is published makes them cache its
+    absence; finding the authoritative name servers only asks the system resolvers about the parent of name.
+
+    :param deadline: time.monotonic() value at which to give up and report the record as not visible, defaults to
+        _TXT_RECORD_CHECK_TIMEOUT seconds from now
+    """
+    if _cache_get(_visible_txt_records, (name, value)):
+        return True
+
+    if deadline is None:
+        deadline = time.monotonic() + _TXT_RECORD_CHECK_TIMEOUT
+    try:
+        nameservers = list(current_app.config.get("ACME_PUBLIC_RESOLVERS", []))
+        nameservers.extend(_authoritative_nameservers(name, deadline))
+        if not nameservers or not all(_txt_record_on_nameserver(name, value, nameserver, deadline) for nameserver in nameservers):
+            return False
+    except dns.exception.DNSException:
+        return False
+
+    _cache_set(_visible_txt_records, (name, value), True, _VISIBLE_TXT_RECORD_TTL)
+    return True
+
+
+def _is_network_error(exception):
+    """
+    Returns whether an exception is a (likely transient) network error. The acme client re-raises most connection
+    errors of requests as a ValueError starting with "Requesting".
+    """
+    if isinstance(exception, (ConnectionError, requests.exceptions.RequestException)):
+        return True
+    return isinstance(exception, ValueError) and str(exception).startswith("Requesting ")
+
+
+def _release_acme_client(acme_client):
+    """Puts the client of a reused account back into the cache, for the next issuance to use"""
+    cache_key = getattr(acme_client, "_cache_key", None)
+    if isinstance(cache_key, tuple):
+        _ACME_CLIENT_CACHE[cache_key] = acme_client
+
+
+def _load_authority_options(authority):
+    """
+    Returns the authority options as a dict of name to value. The parsed result is memoized on the authority and
+    reused for as long as the raw options string is unchanged.
+    """
+    cached = getattr(authority, "_opt_cache", None)
+    if isinstance(cached, tuple) and cached[0] == authority.options:
+        return cached[1]
+
+    options = {}
+    for option in _json_loads(authority.options):
+        options[option["name"]] = option.get("value")
+    authority._opt_cache = (authority.options, options)
+    return options
+
+
+def _load_dns_provider_credentials(dns_provider):
+    """
+    Returns the parsed credentials of a DNS provider. The parsed result is memoized on the provider and reused for
+    as long as the raw credentials string is unchanged.
+    """
+    cached = getattr(dns_provider, "_creds_cache", None)
+    if isinstance(cached, tuple) and cached[0] == dns_provider.credentials:
+        return cached[1]
+
+    credentials = _json_loads(dns_provider.credentials)
+    dns_provider._creds_cache = (dns_provider.credentials, credentials)
+    return credentials
+
 
 class AuthorizationRecord(object):
     def __init__(self, domain, target_domain, authz, dns_challenge, change_id, cname_delegation):
@@ -54,14 +256,9 @@ class AcmeHandler(object):
     def reuse_account(self, authority):
         if not authority.options:
             raise InvalidAuthority("Invalid authority. Options not set")
-        existing_key = False
-        existing_regr = False
-
-        for option in json.loads(authority.options):
-            if option["name"] == "acme_private_key" and option["value"]:
-                existing_key = True
-            if option["name"] == "acme_regr" and option["value"]:
-                existing_regr = True
+        options = _load_authority_options(authority)
+        existing_key = bool(options.get("acme_private_key"))
+        existing_regr = bool(options.get("acme_regr"))
 
         if not existing_key and current_app.config.get("ACME_PRIVATE_KEY"):
             existing_key = True
@@ -89,9 +286,11 @@ class AcmeHandler(object):
         return host
 
     def request_certificate(self, acme_client, authorizations, order):
-        for authorization in authorizations:
-            for authz in authorization.authz:
-                authorization_resource, _ = acme_client.poll(authz)
+        # Every authorization record refers to the authorizations of the whole order, so poll each only once. The
+        # polls stay sequential, the acme client (its nonce pool in particular) is not safe to share across threads
+        authzs = {authz.uri: authz for authorization in authorizations for authz in authorization.authz}
+        for authz in authzs.values():
+            acme_client.poll(authz)
 
         deadline = datetime.now() + timedelta(seconds=360)
 
@@ -125,6 +324,7 @@ class AcmeHandler(object):
         current_app.logger.debug(
             "{0} {1}".format(type(pem_certificate), type(pem_certificate_chain))
         )
+        _release_acme_client(acme_client)
         return pem_certificate, pem_certificate_chain
 
     def extract_cert_and_chain(self, fullchain_pem, alternative_fullchains_pem, preferred_issuer=None):
@@ -136,25 +336,24 @@ class AcmeHandler(object):
             fullchain_pem = acme_crypto_util.find_chain_with_issuer([fullchain_pem] + alternative_fullchains_pem,
                                                                     preferred_issuer)
 
-        pem_certificate = OpenSSL.crypto.dump_certificate(
-            OpenSSL.crypto.FILETYPE_PEM,
-            OpenSSL.crypto.load_certificate(
-                OpenSSL.crypto.FILETYPE_PEM, fullchain_pem
-            ),
-        ).decode()
+        # The leaf is the first PEM block of the chain, split the text instead of round-tripping it through OpenSSL
+        end_marker = "-----END CERTIFICATE-----"
+        leaf_end = fullchain_pem.find(end_marker)
+        if leaf_end == -1:
+            raise ValueError("Unable to find a PEM encoded certificate in the ACME certificate chain")
+        leaf_end += len(end_marker)
 
-        pem_certificate_chain = fullchain_pem[len(pem_certificate):].lstrip()
+        pem_certificate = fullchain_pem[:leaf_end] + "\n"
+        pem_certificate_chain = fullchain_pem[leaf_end:].lstrip()
 
         return pem_certificate, pem_certificate_chain
 
-    @retry(stop_max_attempt_number=5, wait_fixed=5000)
+    @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=0.4, max=5) + wait_random(0, 0.2),
+           retry=retry_if_exception(_is_network_error), reraise=True)
     def setup_acme_client(self, authority):
         if not authority.options:
             raise InvalidAuthority("Invalid authority. Options not set")
-        options = {}
-
-        for option in json.loads(authority.options):
-            options[option["name"]] = option.get("value")
+        options = _load_authority_options(authority)
         email = options.get("email", current_app.config.get("ACME_EMAIL"))
         tel = options.get("telephone", current_app.config.get("ACME_TEL"))
         directory_url = options.get(
@@ -179,12 +378,18 @@ class AcmeHandler(object):
                 existing_key = data_decrypt(existing_key)
 
             key = jose.JWK.json_loads(existing_key)
+            cache_key = (directory_url, key.thumbprint().hex(), existing_regr)
+            client = _ACME_CLIENT_CACHE.pop(cache_key, None)
+            if client:
+                return client, {}
+
             regr = messages.RegistrationResource.json_loads(existing_regr)
             current_app.logger.debug(
                 "Connecting with directory at {0}".format(directory_url)
             )
             net = ClientNetwork(key, account=regr)
             client = BackwardsCompatibleClientV2(net, key, directory_url)
+            client._cache_key = cache_key
             return client, {}
         else:
             # Create an account for each certificate issuance
@@ -214,7 +419,7 @@ class AcmeHandler(object):
 
             # if store_account is checked, add the private_key and registration resources to the options
             if options['store_account']:
-                new_options = json.loads(authority.options)
+                new_options = _json_loads(authority.options)
                 # the key returned by fields_to_partial_json is missing the key type, so we add it manually
                 key_dict = key.fields_to_partial_json()
                 key_dict["kty"] = "RSA"
@@ -245,12 +450,15 @@ class AcmeHandler(object):
         current_app.logger.debug("Fetching domains")
 
         domains = []
+        seen = set()
         if "common_name" in options and options["common_name"].strip():
             domains.append(options["common_name"])
+            seen.add(options["common_name"])
         if options.get("extensions"):
             for dns_name in options["extensions"]["sub_alt_names"]["names"]:
-                if dns_name.value not in domains:
+                if dns_name.value not in seen:
                     domains.append(dns_name.value)
+                    seen.add(dns_name.value)
 
         current_app.logger.debug("Got these domains: {0}".format(domains))
         return domains
@@ -303,9 +511,27 @@ class AcmeDnsHandler(AcmeHandler):
             capture_exception()
             current_app.logger.error(f"Unable to fetch DNS Providers: {e}")
             self.all_dns_providers = []
+        self._zone_trie = self._build_zone_trie(self.all_dns_providers)
+
+    @staticmethod
+    def _build_zone_trie(dns_providers):
+        """
+        Builds a trie of the zones of the DNS providers, keyed by the reversed labels of the zone names. The node of a
+        zone lists the providers serving it under the None key, e.g. {"com": {"example": {None: [provider]}}}.
+        """
+        zone_trie = {}
+        for dns_provider in dns_providers:
+            if not dns_provider.domains:
+                continue
+            for name in dns_provider.domains:
+                node = zone_trie
+                for label in reversed(name.split(".")):
+                    node = node.setdefault(label, {})
+                node.setdefault(None, []).append(dns_provider)
+        return zone_trie
 
     def get_all_zones(self, dns_provider):
-        dns_provider_options = json.loads(dns_provider.credentials)
+        dns_provider_options = _load_dns_provider_credentials(dns_provider)
         account_number = dns_provider_options.get("account_id")
         dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
         return dns_provider_plugin.get_zones(account_number=account_number)
@@ -316,13 +542,12 @@ class AcmeDnsHandler(AcmeHandler):
         """
 
         domain_to_validate, is_wildcard = self.strip_wildcard(host)
+        domain_to_validate = domain_to_validate.lower()
         dns_challenges = []
         for authz in authorizations:
-            if not authz.body.identifier.value.lower() == domain_to_validate.lower():
+            if authz.body.identifier.value.lower() != domain_to_validate:
                 continue
-            if is_wildcard and not authz.body.wildcard:
-                continue
-            if not is_wildcard and authz.body.wildcard:
+            if is_wildcard != bool(authz.body.wildcard):
                 continue
             # skip valid challenge, as long as this challenge is for the domain_to_validate
             if authz.body.status == STATUS_VALID:
@@ -338,15 +563,7 @@ class AcmeDnsHandler(AcmeHandler):
         return dns_challenges, False
 
     def get_dns_provider(self, type):
-        provider_types = {
-            "cloudflare": cloudflare,
-            "dyn": dyn,
-            "route53": route53,
-            "ultradns": ultradns,
-            "powerdns": powerdns,
-            "nsone": nsone
-        }
-        provider = provider_types.get(type)
+        provider = _PROVIDER_TYPES.get(type)
         if not provider:
             raise UnknownProvider("No such DNS provider: {}".format(type))
         return provider
@@ -378,13 +595,15 @@ class AcmeDnsHandler(AcmeHandler):
             metrics.send("start_dns_challenge_error_no_dns_challenges", "counter", 1)
             raise Exception("Unable to determine DNS challenges from authorizations")
 
+        key = acme_client.client.net.key
         for dns_challenge in dns_challenges:
+            record_name = host_to_validate
             if not cname_delegation:
-                host_to_validate = dns_challenge.validation_domain_name(host_to_validate)
+                record_name = dns_challenge.validation_domain_name(host_to_validate)
 
             change_id = dns_provider.create_txt_record(
-                host_to_validate,
-                dns_challenge.validation(acme_client.client.net.key),
+                record_name,
+                dns_challenge.validation(key),
                 account_number,
             )
             change_ids.append(change_id)
@@ -394,63 +613,137 @@ class AcmeDnsHandler(AcmeHandler):
         )
 
     def complete_dns_challenge(self, acme_client, authz_record):
-        current_app.logger.debug(
-            "Finalizing DNS challenge for {0}".format(
-                authz_record.authz[0].body.identifier.value
-            )
-        )
-        dns_providers = self.dns_providers_for_domain.get(authz_record.target_domain)
-        if not dns_providers:
-            metrics.send("complete_dns_challenge_error_no_dnsproviders", "counter", 1)
-            raise Exception(
-                "No DNS providers found for domain: {}".format(authz_record.target_domain)
+        self._await_dns_propagation(acme_client, [authz_record])
+        answers = self._verify_challenges(acme_client, authz_record)
+        if not answers:
+            return
+
+        self._wait_for_txt_records(acme_client, [authz_record])
+        for dns_challenge, response in answers:
+            self._answer_challenge(acme_client, dns_challenge, response)
+
+    def _await_dns_propagation(self, acme_client, authz_records):
+        """
+        Waits until the DNS providers report the TXT record changes of the authorizations as done. The waits of all
+        changes, across authorizations and providers, overlap.
+        """
+        key = acme_client.client.net.key
+        dns_changes = []
+        for authz_record in authz_records:
+            current_app.logger.debug(
+                "Finalizing DNS challenge for {0}".format(
+                    authz_record.authz[0].body.identifier.value
+                )
             )
+            dns_providers = self.dns_providers_for_domain.get(authz_record.target_domain)
+            if not dns_providers:
+                metrics.send("complete_dns_challenge_error_no_dnsproviders", "counter", 1)
+                raise Exception(
+                    "No DNS providers found for domain: {}".format(authz_record.target_domain)
+                )
 
-        for dns_provider in dns_providers:
-            # Grab account number (For Route53)
-            dns_provider_options = json.loads(dns_provider.credentials)
-            account_number = dns_provider_options.get("account_id")
-            dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
-            for change_id in authz_record.change_id:
-                try:
-                    dns_provider_plugin.wait_for_dns_change(
-                        change_id, account_number=account_number
-                    )
-                except Exception:
-                    metrics.send("complete_dns_challenge_error", "counter", 1)
-                    capture_exception()
-                    current_app.logger.debug(
-                        f"Unable to resolve DNS challenge for change_id: {change_id}, account_id: "
-                        f"{account_number}",
-                        exc_info=True,
-                    )
-                    raise
+            txt_records = self._challenge_txt_records(key, authz_record)
+            for dns_provider in dns_providers:
+                # Grab account number (For Route53)
+                dns_provider_options = _load_dns_provider_credentials(dns_provider)
+                account_number = dns_provider_options.get("account_id")
+                dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
+                for change_id in authz_record.change_id:
+                    dns_changes.append((dns_provider_plugin, change_id, account_number, txt_records))
 
-            for dns_challenge in authz_record.dns_challenge:
-                # abort if the status is already valid, no DNS challenge to complete
-                if "status" in dns_challenge and dns_challenge["status"] == STATUS_VALID:
-                    metrics.send("acme_challenge_already_valid", "counter", 1)
-                    return
+        for future in _run_concurrently(self._wait_for_dns_change, dns_changes):
+            future.result()
 
-                response = dns_challenge.response(acme_client.client.net.key)
+    def _wait_for_dns_change(self, dns_provider_plugin, change_id, account_number, txt_records):
+        # Waiting on the provider is slow and pointless once DNS already serves the records
+        if txt_records and all(_txt_record_visible(name, value) for name, value in txt_records):
+            current_app.logger.debug(f"TXT records already visible, not waiting for change_id: {change_id}")
+            return
 
-                verified = response.simple_verify(
-                    dns_challenge.chall,
-                    authz_record.target_domain,
-                    acme_client.client.net.key.public_key(),
-                )
+        try:
+            dns_provider_plugin.wait_for_dns_change(
+                change_id, account_number=account_number
+            )
+        except Exception:
+            metrics.send("complete_dns_challenge_error", "counter", 1)
+            capture_exception()
+            current_app.logger.debug(
+                f"Unable to resolve DNS challenge for change_id: {change_id}, account_id: "
+                f"{account_number}",
+                exc_info=True,
+            )
+            raise
+
+    def _verify_challenges(self, acme_client, authz_record):
+        """
+        Verifies the challenge responses of an authorization, failing on the first one that does not verify.
+
+        :return: list of (dns_challenge, response) pairs to answer, without the challenges that are already valid
+        """
+        key = acme_client.client.net.key
+        answers = []
+        for dns_challenge in authz_record.dns_challenge:
+            # skip if the status is already valid, no DNS challenge to complete
+            if "status" in dns_challenge and dns_challenge["status"] == STATUS_VALID:
+                metrics.send("acme_challenge_already_valid", "counter", 1)
+                continue
 
-            if not verified:
+            response = dns_challenge.response(key)
+            if not response.simple_verify(dns_challenge.chall, authz_record.target_domain, key.public_key()):
                 metrics.send("complete_dns_challenge_verification_error", "counter", 1)
                 raise ValueError("Failed verification")
 
-            time.sleep(5)
-            res = acme_client.answer_challenge(dns_challenge, response)
-            current_app.logger.debug(f"answer_challenge response: {res}")
+            answers.append((dns_challenge, response))
+
+        return answers
+
+    def _wait_for_txt_records(self, acme_client, authz_records):
+        """
+        Polls DNS with an exponential backoff until the challenge TXT records of the authorizations are visible.
+        Gives up silently after _TXT_RECORD_POLL_TIMEOUT seconds, the CA does its own lookups when the challenge is
+        answered.
+        """
+        key = acme_client.client.net.key
+        pending = []
+        for authz_record in authz_records:
+            pending.extend(self._challenge_txt_records(key, authz_record))
+
+        deadline = time.monotonic() + _TXT_RECORD_POLL_TIMEOUT
+        for delay in _TXT_RECORD_POLL_DELAYS + (None,):
+            pending = [(name, value) for name, value in pending if not _txt_record_visible(name, value, deadline)]
+            if not pending:
+                return
+            remaining = deadline - time.monotonic()
+            if delay is None or remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+
+        current_app.logger.debug(f"TXT records not visible yet, answering the challenges anyway: {pending}")
+
+    def _challenge_txt_records(self, key, authz_record):
+        """
+        Returns the (name, value) of every TXT record created for the challenges of an authorization. Like
+        start_dns_challenge, the names are based on the target domain, with the challenge extension of each DNS
+        provider, so that delegated records are looked up where they were written.
+        """
+        host, _ = self.strip_wildcard(authz_record.target_domain)
+        values = [dns_challenge.validation(key) for dns_challenge in authz_record.dns_challenge]
+        txt_records = {}
+        for dns_provider in self.dns_providers_for_domain.get(authz_record.target_domain, []):
+            name = self.maybe_add_extension(host, dns_provider.options)
+            if not authz_record.cname_delegation:
+                name = challenges.DNS01().validation_domain_name(name)
+            for value in values:
+                txt_records[(name, value)] = None
+        return list(txt_records)
+
+    def _answer_challenge(self, acme_client, dns_challenge, response):
+        res = acme_client.answer_challenge(dns_challenge, response)
+        current_app.logger.debug(f"answer_challenge response: {res}")
 
     def get_authorizations(self, acme_client, order, order_info):
         """ The list can be empty if all hostname validations are still valid"""
-        authorizations = []
+        challenges_to_start = []
 
         for domain in order_info.domains:
 
@@ -473,22 +766,33 @@ class AcmeDnsHandler(AcmeHandler):
                 )
                 raise Exception("No DNS providers found for domain: {}".format(target_domain))
 
+            host, _ = self.strip_wildcard(target_domain)
             for dns_provider in self.dns_providers_for_domain[target_domain]:
                 dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
-                dns_provider_options = json.loads(dns_provider.credentials)
+                dns_provider_options = _load_dns_provider_credentials(dns_provider)
                 account_number = dns_provider_options.get("account_id")
-                authz_record = self.start_dns_challenge(
-                    acme_client,
-                    account_number,
-                    domain,
-                    target_domain,
-                    dns_provider_plugin,
-                    order,
-                    dns_provider.options,
-                )
-                # it can be null, if hostname is still valid
-                if authz_record:
-                    authorizations.append(authz_record)
+                challenges_to_start.append((
+                    _change_lock_key(dns_provider.provider_type, host),
+                    (acme_client, account_number, domain, target_domain, dns_provider_plugin, order,
+                     dns_provider.options),
+                ))
+
+        # The DNS provider calls are independent network round-trips, so run them concurrently
+        locks = {lock_key: threading.Lock() for lock_key, _ in challenges_to_start}
+
+        def start(lock_key, args):
+            with locks[lock_key]:
+                return self.start_dns_challenge(*args)
+
+        futures = _run_concurrently(start, challenges_to_start)
+        failures = [future.exception() for future in futures if future.exception()]
+        # it can be null, if hostname is still valid
+        authorizations = [future.result() for future in futures if not future.exception() and future.result()]
+
+        if failures:
+            # Don't leave behind the records of the challenges that did start
+            self.cleanup_dns_challenges(acme_client, authorizations)
+            raise failures[0]
         return authorizations
 
     def autodetect_dns_providers(self, domain):
@@ -497,45 +801,40 @@ class AcmeDnsHandler(AcmeHandler):
         :param domain:
         :return: dns_providers: List of DNS providers that have the correct zone.
         """
-        self.dns_providers_for_domain[domain] = []
-        match_length = 0
-        for dns_provider in self.all_dns_providers:
-            if not dns_provider.domains:
-                continue
-            for name in dns_provider.domains:
-                if name == domain or domain.endswith("." + name):
-                    if len(name) > match_length:
-                        self.dns_providers_for_domain[domain] = [dns_provider]
-                        match_length = len(name)
-                    elif len(name) == match_length:
-                        self.dns_providers_for_domain[domain].append(dns_provider)
+        # The deepest zone along the labels of the domain is the longest match, all providers serving it are kept
+        dns_providers = []
+        node = self._zone_trie
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            dns_providers = node.get(None, dns_providers)
+
+        self.dns_providers_for_domain[domain] = list(dns_providers)
 
         return self.dns_providers_for_domain
 
     def finalize_authorizations(self, acme_client, authorizations):
+        # Let all records propagate at the same time and wait for their visibility once, instead of paying both
+        # once per authorization
+        self._await_dns_propagation(acme_client, authorizations)
+
+        answered_records = []
+        answers = []
         for authz_record in authorizations:
-            self.complete_dns_challenge(acme_client, authz_record)
-        for authz_record in authorizations:
-            dns_challenges = authz_record.dns_challenge
-            for dns_challenge in dns_challenges:
-                dns_providers = self.dns_providers_for_domain.get(authz_record.target_domain)
-                for dns_provider in dns_providers:
-                    # Grab account number (For Route53)
-                    dns_provider_plugin = self.get_dns_provider(
-                        dns_provider.provider_type
-                    )
-                    dns_provider_options = json.loads(dns_provider.credentials)
-                    account_number = dns_provider_options.get("account_id")
-                    host_to_validate, _ = self.strip_wildcard(authz_record.target_domain)
-                    host_to_validate = self.maybe_add_extension(host_to_validate, dns_provider_options)
-                    if not authz_record.cname_delegation:
-                        host_to_validate = challenges.DNS01().validation_domain_name(host_to_validate)
-                    dns_provider_plugin.delete_txt_record(
-                        authz_record.change_id,
-                        account_number,
-                        host_to_validate,
-                        dns_challenge.validation(acme_client.client.net.key),
-                    )
+            record_answers = self._verify_challenges(acme_client, authz_record)
+            if record_answers:
+                answered_records.append(authz_record)
+                answers.extend(record_answers)
+
+        if answers:
+            self._wait_for_txt_records(acme_client, answered_records)
+            # The acme client is not thread-safe, answer the challenges one after another
+            for dns_challenge, response in answers:
+                self._answer_challenge(acme_client, dns_challenge, response)
+
+        for dns_provider, records in self._created_txt_records_by_provider(acme_client, authorizations):
+            self._delete_records_bulk(dns_provider, records)
 
         return authorizations
 
@@ -551,35 +850,79 @@ class AcmeDnsHandler(AcmeHandler):
         :param dns_provider_options:
         :return:
         """
+        def on_error(e):
+            # If this fails, it's most likely because the record doesn't exist (It was already cleaned up)
+            # or we're not authorized to modify it.
+            metrics.send("cleanup_dns_challenges_error", "counter", 1)
+            capture_exception()
+
+        for dns_provider, records in self._created_txt_records_by_provider(acme_client, authorizations):
+            self._delete_records_bulk(dns_provider, records, on_error=on_error)
+
+    def _created_txt_records_by_provider(self, acme_client, authorizations):
+        """
+        Collects the TXT records created for the challenges of the authorizations, per DNS provider.
+
+        :param acme_client:
+        :param authorizations:
+        :return: list of (dns_provider, records) pairs, records being (change_id, account_number, host, value) tuples
+        """
+        key = acme_client.client.net.key
+        records_by_provider = {}
         for authz_record in authorizations:
-            dns_providers = self.dns_providers_for_domain.get(authz_record.target_domain)
-            for dns_provider in dns_providers:
+            # Neither the host nor the validations depend on the provider, compute them once
+            host, _ = self.strip_wildcard(authz_record.target_domain)
+            validations = [dns_challenge.validation(key) for dns_challenge in authz_record.dns_challenge]
+
+            for dns_provider in self.dns_providers_for_domain.get(authz_record.target_domain, []):
                 # Grab account number (For Route53)
-                dns_provider_options = json.loads(dns_provider.credentials)
+                dns_provider_options = _load_dns_provider_credentials(dns_provider)
                 account_number = dns_provider_options.get("account_id")
-                dns_challenges = authz_record.dns_challenge
-                host_to_validate, _ = self.strip_wildcard(authz_record.target_domain)
-                host_to_validate = self.maybe_add_extension(
-                    host_to_validate, dns_provider_options
-                )
+                host_to_validate = self.maybe_add_extension(host, dns_provider_options)
+                if not authz_record.cname_delegation:
+                    host_to_validate = challenges.DNS01().validation_domain_name(host_to_validate)
 
-                dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
-                for dns_challenge in dns_challenges:
-                    if not authz_record.cname_delegation:
-                        host_to_validate = dns_challenge.validation_domain_name(host_to_validate)
-                    try:
-                        dns_provider_plugin.delete_txt_record(
-                            authz_record.change_id,
-                            account_number,
-                            host_to_validate,
-                            dns_challenge.validation(acme_client.client.net.key),
-                        )
-                    except Exception as e:
-                        # If this fails, it's most likely because the record doesn't exist (It was already cleaned up)
-                        # or we're not authorized to modify it.
-                        metrics.send("cleanup_dns_challenges_error", "counter", 1)
-                        capture_exception()
-                        pass
+                _, records = records_by_provider.setdefault(id(dns_provider), (dns_provider, []))
+                for validation in validations:
+                    records.append((authz_record.change_id, account_number, host_to_validate, validation))
+
+        return list(records_by_provider.values())
+
+    def _delete_records_bulk(self, dns_provider, records, on_error=None):
+        """
+        Deletes TXT records through the plugin of a DNS provider. A plugin may implement delete_txt_records_bulk to
+        remove them all in one call; otherwise the records are deleted concurrently, while changes sharing a lock key
+        still happen one after another.
+
+        :param dns_provider:
+        :param records: list of (change_id, account_number, host, value) tuples, as taken by delete_txt_record
+        :param on_error: called with the exception of a failed deletion, which is raised if not provided
+        :return:
+        """
+        dns_provider_plugin = self.get_dns_provider(dns_provider.provider_type)
+
+        def delete(delete_function, *args):
+            try:
+                delete_function(*args)
+            except Exception as e:
+                if not on_error:
+                    raise
+                on_error(e)
+
+        if hasattr(dns_provider_plugin, "delete_txt_records_bulk"):
+            delete(dns_provider_plugin.delete_txt_records_bulk, records)
+            return
+
+        groups = {}
+        for record in records:
+            groups.setdefault(_change_lock_key(dns_provider.provider_type, record[2]), []).append(record)
+
+        def delete_group(group):
+            for record in group:
+                delete(dns_provider_plugin.delete_txt_record, *record)
+
+        for future in _run_concurrently(delete_group, [(group,) for group in groups.values()]):
+            future.result()
 
     def get_cname(self, domain):
         """
@@ -26,7 +26,7 @@ from lemur.plugins.base import plugins
 from lemur.destinations import service as destination_service
 from lemur.plugins.lemur_acme.acme_handlers import AcmeHandler, AcmeDnsHandler
 
-from retrying import retry
+from tenacity import retry, stop_after_attempt, wait_fixed
 
 
 class AcmeChallengeMissmatchError(LemurException):
@@ -263,7 +263,7 @@ class AcmeDnsChallenge(AcmeChallenge):
         # TODO add external ID (if possible)
         return pem_certificate, pem_certificate_chain, None
 
-    @retry(stop_max_attempt_number=ACME_ADDITIONAL_ATTEMPTS, wait_fixed=5000)
+    @retry(stop=stop_after_attempt(ACME_ADDITIONAL_ATTEMPTS), wait=wait_fixed(5), reraise=True)
     def create_certificate_immediately(self, acme_client, order_info, csr):
         try:
             order = acme_client.new_order(csr)
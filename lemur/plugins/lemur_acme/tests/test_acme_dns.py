@@ -1,12 +1,12 @@
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import call, patch, Mock
 
 import josepy as jose
 
 from acme.messages import STATUS_PENDING, STATUS_VALID
 from cryptography.x509 import DNSName
 from flask import Flask, current_app
-from lemur.plugins.lemur_acme import plugin
+from lemur.plugins.lemur_acme import acme_handlers, plugin
 from lemur.plugins.lemur_acme.acme_handlers import AuthorizationRecord
 from lemur.common.utils import generate_private_key
 from lemur.tests.conf import LEMUR_ENCRYPTION_KEYS
@@ -22,6 +22,7 @@ class TestAcmeDns(unittest.TestCase):
         mock_dns_provider.name = "cloudflare"
         mock_dns_provider.credentials = "{}"
         mock_dns_provider.provider_type = "cloudflare"
+        mock_dns_provider.options = {}
         self.acme.dns_providers_for_domain = {
             "www.test.com": [mock_dns_provider],
             "test.fakedomain.net": [mock_dns_provider],
@@ -33,8 +34,10 @@ class TestAcmeDns(unittest.TestCase):
         self.ctx = _app.app_context()
         assert self.ctx
         self.ctx.push()
+        acme_handlers._ACME_CLIENT_CACHE.clear()
 
     def tearDown(self):
+        acme_handlers._ACME_CLIENT_CACHE.clear()
         self.ctx.pop()
 
     @patch("lemur.plugins.lemur_acme.plugin.len", return_value=1)
@@ -135,18 +138,21 @@ class TestAcmeDns(unittest.TestCase):
 
     @patch("acme.client.Client")
     @patch("lemur.plugins.lemur_acme.cloudflare.wait_for_dns_change")
+    @patch("lemur.plugins.lemur_acme.acme_handlers._txt_record_visible", return_value=True)
     @patch("time.sleep")
     def test_complete_dns_challenge_success(
-            self, mock_sleep, mock_wait_for_dns_change, mock_acme
+            self, mock_sleep, mock_txt_record_visible, mock_wait_for_dns_change, mock_acme
     ):
         mock_dns_provider = Mock()
         mock_dns_provider.wait_for_dns_change = Mock(return_value=True)
         mock_authz = Mock()
+        mock_authz.domain = "www.test.com"
         mock_sleep.return_value = False
         mock_authz.dns_challenge.response = Mock()
         mock_authz.dns_challenge.response.simple_verify = Mock(return_value=True)
         mock_authz.authz = []
         mock_authz.target_domain = "www.test.com"
+        mock_authz.cname_delegation = False
         mock_authz_record = Mock()
         mock_authz_record.body.identifier.value = "test"
         mock_authz.authz.append(mock_authz_record)
@@ -157,11 +163,17 @@ class TestAcmeDns(unittest.TestCase):
         dns_challenge["status"] == STATUS_PENDING
         mock_authz.dns_challenge.append(dns_challenge)
         self.acme.complete_dns_challenge(mock_acme, mock_authz)
+        # the records are already visible, neither waiting on the provider nor sleeping is needed
+        mock_txt_record_visible.assert_any_call("_acme-challenge.www.test.com", dns_challenge.validation.return_value)
+        mock_wait_for_dns_change.assert_not_called()
+        mock_sleep.assert_not_called()
+        mock_acme.answer_challenge.assert_called_once()
 
     @patch("acme.client.Client")
     @patch("lemur.plugins.lemur_acme.cloudflare.wait_for_dns_change")
+    @patch("lemur.plugins.lemur_acme.acme_handlers._txt_record_visible", return_value=False)
     def test_complete_dns_challenge_fail(
-            self, mock_wait_for_dns_change, mock_acme
+            self, mock_txt_record_visible, mock_wait_for_dns_change, mock_acme
     ):
         mock_dns_provider = Mock()
         mock_dns_provider.wait_for_dns_change = Mock(return_value=True)
@@ -177,6 +189,7 @@ class TestAcmeDns(unittest.TestCase):
         mock_authz.dns_challenge.append(mock_dns_challenge)
 
         mock_authz.target_domain = "www.test.com"
+        mock_authz.domain = "www.test.com"
         mock_authz_record = Mock()
         mock_authz_record.body.identifier.value = "test"
         mock_authz.authz = []
@@ -185,6 +198,81 @@ class TestAcmeDns(unittest.TestCase):
         mock_authz.change_id.append("123")
         with self.assertRaises(ValueError):
             self.acme.complete_dns_challenge(mock_acme, mock_authz)
+        mock_wait_for_dns_change.assert_called_once()
+
+    def test_verify_challenges_fails_on_any_challenge(self):
+        mock_acme = MagicMock()
+        failing_challenge = MagicMock()
+        failing_challenge.response.return_value.simple_verify.return_value = False
+        passing_challenge = MagicMock()
+        passing_challenge.response.return_value.simple_verify.return_value = True
+
+        mock_authz = Mock()
+        mock_authz.target_domain = "www.test.com"
+        mock_authz.dns_challenge = [passing_challenge]
+        answers = self.acme._verify_challenges(mock_acme, mock_authz)
+        self.assertEqual(answers, [(passing_challenge, passing_challenge.response.return_value)])
+
+        # a failing challenge is not masked by a later one that verifies
+        mock_authz.dns_challenge = [failing_challenge, passing_challenge]
+        with self.assertRaises(ValueError):
+            self.acme._verify_challenges(mock_acme, mock_authz)
+        passing_challenge.response.assert_called_once()
+
+    @patch("lemur.plugins.lemur_acme.cloudflare.wait_for_dns_change")
+    def test_await_dns_propagation(self, mock_wait_for_dns_change):
+        mock_authz1 = MagicMock()
+        mock_authz1.target_domain = "www.test.com"
+        mock_authz1.change_id = ["123", "456"]
+        mock_authz2 = MagicMock()
+        mock_authz2.target_domain = "test.fakedomain.net"
+        mock_authz2.change_id = ["789"]
+
+        mock_acme = MagicMock()
+        self.acme._await_dns_propagation(mock_acme, [mock_authz1, mock_authz2])
+        self.assertEqual(mock_wait_for_dns_change.call_count, 3)
+        for change_id in ["123", "456", "789"]:
+            mock_wait_for_dns_change.assert_any_call(change_id, account_number=None)
+
+        mock_wait_for_dns_change.side_effect = Exception("timeout")
+        with self.assertRaises(Exception):
+            self.acme._await_dns_propagation(mock_acme, [mock_authz1, mock_authz2])
+
+    @patch("lemur.plugins.lemur_acme.acme_handlers.time")
+    @patch("lemur.plugins.lemur_acme.acme_handlers._txt_record_visible")
+    def test_wait_for_txt_records_backoff(self, mock_txt_record_visible, mock_time):
+        clock = [100.0]
+        mock_time.monotonic.side_effect = lambda: clock[0]
+        mock_time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        mock_acme = Mock()
+        mock_dns_challenge = Mock()
+        mock_dns_challenge.validation = Mock(return_value="token")
+        mock_authz = Mock()
+        mock_authz.domain = "*.www.test.com"
+        mock_authz.target_domain = "www.test.com"
+        mock_authz.cname_delegation = False
+        mock_authz.dns_challenge = [mock_dns_challenge]
+
+        mock_txt_record_visible.side_effect = [False, False, True]
+        self.acme._wait_for_txt_records(mock_acme, [mock_authz])
+        mock_txt_record_visible.assert_called_with("_acme-challenge.www.test.com", "token", 105.0)
+        self.assertEqual([c[0][0] for c in mock_time.sleep.call_args_list], [0.2, 0.4])
+
+        # gives up after at most 5 seconds
+        mock_time.sleep.reset_mock()
+        mock_txt_record_visible.side_effect = None
+        mock_txt_record_visible.return_value = False
+        self.acme._wait_for_txt_records(mock_acme, [mock_authz])
+        self.assertAlmostEqual(sum(c[0][0] for c in mock_time.sleep.call_args_list), 5)
+
+        # records are looked up where they were written, delegated or with the challenge extension
+        self.acme.dns_providers_for_domain["www.test.com"][0].options = {"acme_challenge_extension": ".ext.test.com"}
+        self.assertEqual(self.acme._challenge_txt_records(mock_acme.client.net.key, mock_authz),
+                         [("_acme-challenge.www.test.com.ext.test.com", "token")])
+        mock_authz.target_domain = "test.fakedomain.net"
+        mock_authz.cname_delegation = True
+        self.assertEqual(self.acme._challenge_txt_records(mock_acme.client.net.key, mock_authz),
+                         [("test.fakedomain.net.ext.test.com", "token")])
 
     @patch("acme.client.Client")
     @patch("OpenSSL.crypto", return_value="mock_cert")
@@ -236,6 +324,22 @@ class TestAcmeDns(unittest.TestCase):
         assert result_client
         assert not result_registration
 
+        # the client is not shared while in use
+        other_client, _ = self.acme.setup_acme_client(mock_authority)
+        self.assertEqual(mock_acme.call_count, 2)
+
+        # but reused by the next issuance once it succeeded
+        acme_handlers._release_acme_client(result_client)
+        cached_client, _ = self.acme.setup_acme_client(mock_authority)
+        self.assertIs(cached_client, result_client)
+        self.assertEqual(mock_acme.call_count, 2)
+
+        # an edited registration is picked up
+        acme_handlers._release_acme_client(result_client)
+        mock_authority.options = mock_authority.options.replace("http://test.com", "http://test.com/acct/2")
+        self.acme.setup_acme_client(mock_authority)
+        self.assertEqual(mock_acme.call_count, 3)
+
     @patch("lemur.plugins.lemur_acme.acme_handlers.jose.JWKRSA.fields_to_partial_json")
     @patch("lemur.plugins.lemur_acme.acme_handlers.authorities_service")
     @patch("lemur.plugins.lemur_acme.acme_handlers.BackwardsCompatibleClientV2")
@@ -384,11 +488,30 @@ class TestAcmeDns(unittest.TestCase):
         )
         self.assertEqual(result, ["test"])
 
-    @patch(
-        "lemur.plugins.lemur_acme.plugin.AcmeDnsHandler.complete_dns_challenge",
-        return_value="test",
-    )
-    def test_finalize_authorizations(self, mock_complete_dns_challenge):
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler.cleanup_dns_challenges")
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler.start_dns_challenge")
+    def test_get_authorizations_fail(self, mock_start_dns_challenge, mock_cleanup_dns_challenges):
+        error = Exception("provider error")
+
+        def start_dns_challenge(acme_client, account_number, domain, *args):
+            if domain == "test.fakedomain.net":
+                raise error
+            return f"record for {domain}"
+
+        mock_start_dns_challenge.side_effect = start_dns_challenge
+        mock_order_info = Mock()
+        mock_order_info.domains = ["www.test.com", "test.fakedomain.net"]
+        with self.assertRaises(Exception) as context:
+            self.acme.get_authorizations("acme_client", Mock(), mock_order_info)
+
+        # the original error is raised, once the records of the started challenges are cleaned up
+        self.assertIs(context.exception, error)
+        self.assertEqual(mock_start_dns_challenge.call_count, 2)
+        mock_cleanup_dns_challenges.assert_called_once_with("acme_client", ["record for www.test.com"])
+
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._await_dns_propagation")
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._verify_challenges", return_value=[])
+    def test_finalize_authorizations(self, mock_verify_challenges, mock_await_dns_propagation):
         mock_authz = []
         mock_authz_record = MagicMock()
         mock_authz_record.authz = Mock()
@@ -402,6 +525,86 @@ class TestAcmeDns(unittest.TestCase):
         mock_acme_client = Mock()
         result = self.acme.finalize_authorizations(mock_acme_client, mock_authz)
         self.assertEqual(result, mock_authz)
+        mock_await_dns_propagation.assert_called_once_with(mock_acme_client, mock_authz)
+        mock_verify_challenges.assert_called_once_with(mock_acme_client, mock_authz_record)
+
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._wait_for_txt_records")
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._await_dns_propagation")
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._verify_challenges")
+    @patch("lemur.plugins.lemur_acme.plugin.AcmeDnsHandler._answer_challenge")
+    def test_finalize_authorizations_single_wait(self, mock_answer_challenge, mock_verify_challenges,
+                                                 mock_await_dns_propagation, mock_wait_for_txt_records):
+        mock_authz = [MagicMock(), MagicMock(), MagicMock()]
+        mock_verify_challenges.side_effect = [[("challenge1", "response1")], [], [("challenge3", "response3")]]
+
+        mock_acme_client = Mock()
+        self.acme.finalize_authorizations(mock_acme_client, mock_authz)
+        mock_await_dns_propagation.assert_called_once_with(mock_acme_client, mock_authz)
+        mock_wait_for_txt_records.assert_called_once_with(mock_acme_client, [mock_authz[0], mock_authz[2]])
+        self.assertEqual(mock_answer_challenge.call_args_list, [
+            call(mock_acme_client, "challenge1", "response1"),
+            call(mock_acme_client, "challenge3", "response3"),
+        ])
+
+    @patch("lemur.plugins.lemur_acme.acme_handlers.dns_provider_service")
+    def test_autodetect_dns_providers(self, mock_dns_provider_service):
+        provider1 = Mock(domains=["test.com", "fakedomain.net"])
+        provider2 = Mock(domains=["www.test.com"])
+        provider3 = Mock(domains=["test.com"])
+        provider4 = Mock(domains=None)
+        mock_dns_provider_service.get_all_dns_providers.return_value = [provider1, provider2, provider3, provider4]
+        acme = plugin.AcmeDnsHandler()
+
+        self.assertEqual(acme.autodetect_dns_providers("www.test.com")["www.test.com"], [provider2])
+        self.assertEqual(acme.autodetect_dns_providers("*.www.test.com")["*.www.test.com"], [provider2])
+        self.assertEqual(acme.autodetect_dns_providers("api.test.com")["api.test.com"], [provider1, provider3])
+        self.assertEqual(acme.autodetect_dns_providers("test.com")["test.com"], [provider1, provider3])
+        self.assertEqual(acme.autodetect_dns_providers("mytest.com")["mytest.com"], [])
+        self.assertEqual(acme.autodetect_dns_providers("net")["net"], [])
+
+    def test_created_txt_records_by_provider(self):
+        mock_acme = MagicMock()
+        mock_dns_provider = self.acme.dns_providers_for_domain["www.test.com"][0]
+        dns_challenge1 = Mock()
+        dns_challenge1.validation = Mock(return_value="token1")
+        dns_challenge2 = Mock()
+        dns_challenge2.validation = Mock(return_value="token2")
+        authz_record = AuthorizationRecord(
+            "*.www.test.com", "www.test.com", [], [dns_challenge1, dns_challenge2], ["change1"], False
+        )
+        delegated_authz_record = AuthorizationRecord(
+            "www.example.com", "test.fakedomain.net", [], [dns_challenge1], ["change2"], True
+        )
+
+        result = self.acme._created_txt_records_by_provider(mock_acme, [authz_record, delegated_authz_record])
+        self.assertEqual(result, [(mock_dns_provider, [
+            (["change1"], None, "_acme-challenge.www.test.com", "token1"),
+            (["change1"], None, "_acme-challenge.www.test.com", "token2"),
+            (["change2"], None, "test.fakedomain.net", "token1"),
+        ])])
+        dns_challenge1.validation.assert_called_with(mock_acme.client.net.key)
+        self.assertEqual(dns_challenge1.validation.call_count, 2)
+
+    @patch("lemur.plugins.lemur_acme.cloudflare.delete_txt_record")
+    def test_delete_records_bulk(self, mock_delete_txt_record):
+        mock_dns_provider = self.acme.dns_providers_for_domain["www.test.com"][0]
+        records = [
+            ("change1", None, "_acme-challenge.www.test.com", "token1"),
+            ("change1", None, "_acme-challenge.www.test.com", "token2"),
+            ("change2", None, "_acme-challenge.test.fakedomain.net", "token3"),
+        ]
+        self.acme._delete_records_bulk(mock_dns_provider, records)
+        self.assertEqual(mock_delete_txt_record.call_count, 3)
+        for record in records:
+            mock_delete_txt_record.assert_any_call(*record)
+
+        mock_delete_txt_record.side_effect = Exception("not found")
+        with self.assertRaises(Exception):
+            self.acme._delete_records_bulk(mock_dns_provider, records)
+
+        on_error = Mock()
+        self.acme._delete_records_bulk(mock_dns_provider, records, on_error=on_error)
+        self.assertEqual(on_error.call_count, 3)
 
     @patch("lemur.plugins.lemur_acme.plugin.AcmeHandler.setup_acme_client")
     @patch("lemur.plugins.lemur_acme.plugin.authorization_service")
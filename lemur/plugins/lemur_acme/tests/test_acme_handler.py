@@ -1,7 +1,7 @@
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import ANY, patch, Mock
 
-from flask import Flask
+from flask import Flask, current_app
 from cryptography.x509 import DNSName
 from lemur.plugins.lemur_acme import acme_handlers
 
@@ -22,8 +22,10 @@ class TestAcmeHandler(unittest.TestCase):
         self.ctx = _app.app_context()
         assert self.ctx
         self.ctx.push()
+        acme_handlers._ACME_CLIENT_CACHE.clear()
 
     def tearDown(self):
+        acme_handlers._ACME_CLIENT_CACHE.clear()
         self.ctx.pop()
 
     def test_strip_wildcard(self):
@@ -45,6 +47,24 @@ class TestAcmeHandler(unittest.TestCase):
         with self.assertRaises(Exception):
             self.acme.setup_acme_client(mock_authority)
 
+    @patch("lemur.plugins.lemur_acme.acme_handlers.BackwardsCompatibleClientV2")
+    def test_setup_acme_client_retry(self, mock_acme):
+        mock_authority = Mock()
+        mock_authority.options = '[{"name": "store_account", "value": false}]'
+
+        # configuration errors are not retried
+        mock_acme.side_effect = KeyError("directory")
+        with self.assertRaises(KeyError):
+            self.acme.setup_acme_client(mock_authority)
+        self.assertEqual(mock_acme.call_count, 1)
+
+        # network errors are
+        mock_acme.reset_mock()
+        mock_acme.side_effect = [ValueError("Requesting acme.test/directory: Connection refused"), Mock()]
+        result_client, _ = self.acme.setup_acme_client(mock_authority)
+        assert result_client
+        self.assertEqual(mock_acme.call_count, 2)
+
     def test_reuse_account_not_defined(self):
         mock_authority = Mock()
         mock_authority.options = []
@@ -71,6 +91,20 @@ class TestAcmeHandler(unittest.TestCase):
 
         self.assertFalse(self.acme.reuse_account(mock_authority))
 
+    @patch("lemur.plugins.lemur_acme.acme_handlers._json_loads", wraps=acme_handlers._json_loads)
+    def test_load_authority_options_cached(self, mock_json_loads):
+        mock_authority = Mock()
+        mock_authority.options = '[{"name": "mock_name", "value": "mock_value"}]'
+
+        self.assertEqual(acme_handlers._load_authority_options(mock_authority), {"mock_name": "mock_value"})
+        self.assertEqual(acme_handlers._load_authority_options(mock_authority), {"mock_name": "mock_value"})
+        mock_json_loads.assert_called_once()
+
+        # changed options are parsed again
+        mock_authority.options = '[{"name": "mock_name", "value": "other_value"}]'
+        self.assertEqual(acme_handlers._load_authority_options(mock_authority), {"mock_name": "other_value"})
+        self.assertEqual(mock_json_loads.call_count, 2)
+
     @patch("lemur.plugins.lemur_acme.acme_handlers.authorities_service")
     @patch("lemur.plugins.lemur_acme.acme_handlers.BackwardsCompatibleClientV2")
     def test_setup_acme_client_success(self, mock_acme, mock_authorities_service):
@@ -88,6 +122,59 @@ class TestAcmeHandler(unittest.TestCase):
         assert result_client
         assert result_registration
 
+    @patch("lemur.plugins.lemur_acme.acme_handlers._txt_record_on_nameserver")
+    @patch("lemur.plugins.lemur_acme.acme_handlers._authoritative_nameservers", return_value=["192.0.2.53"])
+    def test_txt_record_visible(self, mock_authoritative_nameservers, mock_txt_record_on_nameserver):
+        name = "_acme-challenge.test.netflix.net"
+        acme_handlers._visible_txt_records.clear()
+
+        # not yet served by the authoritative name server
+        mock_txt_record_on_nameserver.return_value = False
+        self.assertFalse(acme_handlers._txt_record_visible(name, "token"))
+
+        # only the authoritative name servers are asked by default
+        mock_txt_record_on_nameserver.reset_mock()
+        mock_txt_record_on_nameserver.return_value = True
+        self.assertTrue(acme_handlers._txt_record_visible(name, "token"))
+        mock_txt_record_on_nameserver.assert_called_once_with(name, "token", "192.0.2.53", ANY)
+
+        # a visible record is remembered
+        mock_txt_record_on_nameserver.reset_mock()
+        self.assertTrue(acme_handlers._txt_record_visible(name, "token"))
+        mock_txt_record_on_nameserver.assert_not_called()
+
+        # configured resolvers are asked as well, and expired records are forgotten
+        current_app.config["ACME_PUBLIC_RESOLVERS"] = ["192.0.2.1"]
+        acme_handlers._visible_txt_records[(name, "token")] = (0, True)
+        self.assertTrue(acme_handlers._txt_record_visible(name, "other_token"))
+        mock_txt_record_on_nameserver.assert_any_call(name, "other_token", "192.0.2.1", ANY)
+        mock_txt_record_on_nameserver.assert_any_call(name, "other_token", "192.0.2.53", ANY)
+        self.assertEqual(list(acme_handlers._visible_txt_records), [(name, "other_token")])
+
+    @patch("lemur.plugins.lemur_acme.acme_handlers._resolver")
+    @patch("lemur.plugins.lemur_acme.acme_handlers.dns.resolver.zone_for_name")
+    def test_authoritative_nameservers(self, mock_zone_for_name, mock_resolver):
+        mock_zone_for_name.return_value = "netflix.net."
+        ns = Mock()
+        ns.target = "ns1.netflix.net."
+        a = Mock()
+        a.address = "192.0.2.53"
+        mock_resolver.return_value.query.side_effect = lambda name, rdtype: {"NS": [ns], "A": [a]}[rdtype]
+
+        acme_handlers._zone_nameservers.clear()
+
+        nameservers = acme_handlers._authoritative_nameservers("_acme-challenge.test.netflix.net", 0)
+        self.assertEqual(nameservers, ["192.0.2.53"])
+        # the challenge name itself is not sent to the system resolvers
+        self.assertEqual(str(mock_zone_for_name.call_args[0][0]), "test.netflix.net.")
+
+        # the name servers are looked up once for the records of a name
+        mock_resolver.reset_mock()
+        nameservers = acme_handlers._authoritative_nameservers("_acme-challenge.test.netflix.net", 0)
+        self.assertEqual(nameservers, ["192.0.2.53"])
+        mock_zone_for_name.assert_called_once()
+        mock_resolver.assert_not_called()
+
     def test_get_domains_single(self):
         options = {"common_name": "test.netflix.net"}
         result = self.acme.get_domains(options)
@@ -8,7 +8,7 @@
 import botocore
 from flask import current_app
 
-from retrying import retry
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
 from sentry_sdk import capture_exception
 
 from lemur.extensions import metrics
@@ -175,7 +175,7 @@ def get_all_elbs_v2(**kwargs):
 
 
 @sts_client("elbv2")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def get_listener_arn_from_endpoint(endpoint_name, endpoint_port, **kwargs):
     """
     Get a listener ARN from an endpoint.
@@ -214,7 +214,7 @@ def get_listener_arn_from_endpoint(endpoint_name, endpoint_port, **kwargs):
 
 
 @sts_client("elbv2")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=5)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(5), reraise=True)
 def get_load_balancer_arn_from_endpoint(endpoint_name, **kwargs):
     """
     Get a load balancer ARN from an endpoint.
@@ -253,7 +253,7 @@ def get_elbs(**kwargs):
     return _get_elbs(**kwargs)
 
 
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def _get_elbs(**kwargs):
     """
     Fetches one page elb objects for a given account and region.
@@ -278,7 +278,7 @@ def get_elbs_v2(**kwargs):
     return _get_elbs_v2(**kwargs)
 
 
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def _get_elbs_v2(**kwargs):
     """
     Fetches one page of elb objects for a given account and region.
@@ -296,7 +296,7 @@ def _get_elbs_v2(**kwargs):
 
 
 @sts_client("elbv2")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def describe_listeners_v2(**kwargs):
     """
     Fetches one page of listener objects for a given elb arn.
@@ -316,7 +316,7 @@ def describe_listeners_v2(**kwargs):
 
 
 @sts_client("elb")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def describe_load_balancer_policies(load_balancer_name, policy_names, **kwargs):
     """
     Fetching all policies currently associated with an ELB.
@@ -350,7 +350,7 @@ def describe_load_balancer_policies(load_balancer_name, policy_names, **kwargs):
 
 
 @sts_client("elbv2")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def describe_ssl_policies_v2(policy_names, **kwargs):
     """
     Fetching all policies currently associated with an ELB.
@@ -372,7 +372,7 @@ def describe_ssl_policies_v2(policy_names, **kwargs):
 
 
 @sts_client("elb")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def describe_load_balancer_types(policies, **kwargs):
     """
     Describe the policies with policy details.
@@ -386,7 +386,7 @@ def describe_load_balancer_types(policies, **kwargs):
 
 
 @sts_client("elb")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def attach_certificate(name, port, certificate_id, **kwargs):
     """
     Attaches a certificate to a listener, throws exception
@@ -410,7 +410,7 @@ def attach_certificate(name, port, certificate_id, **kwargs):
 
 
 @sts_client("elbv2")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=20)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(20), reraise=True)
 def attach_certificate_v2(listener_arn, port, certificates, **kwargs):
     """
     Attaches a certificate to a listener, throws exception
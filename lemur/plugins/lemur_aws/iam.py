@@ -8,7 +8,7 @@
 """
 import botocore
 
-from retrying import retry
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
 from sentry_sdk import capture_exception
 
 from lemur.extensions import metrics
@@ -108,7 +108,7 @@ def create_arn_from_cert(account_number, partition, certificate_name, path=''):
 
 
 @sts_client("iam")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=25)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(25), reraise=True)
 def upload_cert(name, body, private_key, path, cert_chain=None, **kwargs):
     """
     Upload a certificate to AWS
@@ -149,7 +149,7 @@ def upload_cert(name, body, private_key, path, cert_chain=None, **kwargs):
 
 
 @sts_client("iam")
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=25)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(25), reraise=True)
 def delete_cert(cert_name, **kwargs):
     """
     Delete a certificate from AWS
@@ -176,7 +176,7 @@ def get_certificate(name, **kwargs):
     return _get_certificate(name, **kwargs)
 
 
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=25)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(25), reraise=True)
 def _get_certificate(name, **kwargs):
     metrics.send("get_certificate", "counter", 1, metric_tags={"name": name})
     client = kwargs.pop("client")
@@ -197,7 +197,7 @@ def get_certificates(**kwargs):
     return _get_certificates(**kwargs)
 
 
-@retry(retry_on_exception=retry_throttled, wait_fixed=2000, stop_max_attempt_number=25)
+@retry(retry=retry_if_exception(retry_throttled), wait=wait_fixed(2), stop=stop_after_attempt(25), reraise=True)
 def _get_certificates(**kwargs):
     metrics.send("get_certificates", "counter", 1)
     return kwargs.pop("client").list_server_certificates(**kwargs)
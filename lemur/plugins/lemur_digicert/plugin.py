@@ -25,7 +25,7 @@ from lemur.common.utils import validate_conf, convert_pkcs7_bytes_to_pem
 from lemur.extensions import metrics
 from lemur.plugins import lemur_digicert as digicert
 from lemur.plugins.bases import IssuerPlugin, SourcePlugin
-from retrying import retry
+from tenacity import retry, stop_after_attempt, wait_fixed
 from requests.packages.urllib3.util.retry import Retry
 
 
@@ -253,7 +253,7 @@ def handle_cis_response(session, response):
         return response.json()
 
 
-@retry(stop_max_attempt_number=10, wait_fixed=1000)
+@retry(stop=stop_after_attempt(10), wait=wait_fixed(1), reraise=True)
 def get_certificate_id(session, base_url, order_id):
     """Retrieve certificate order id from Digicert API."""
     order_url = "{0}/services/v2/order/certificate/{1}".format(base_url, order_id)
@@ -264,7 +264,7 @@ def get_certificate_id(session, base_url, order_id):
     return response_data["certificate"]["id"]
 
 
-@retry(stop_max_attempt_number=10, wait_fixed=1000)
+@retry(stop=stop_after_attempt(10), wait=wait_fixed(1), reraise=True)
 def get_cis_certificate(session, base_url, order_id):
     """Retrieve certificate order id from Digicert API, including the chain"""
     certificate_url = "{0}/platform/cis/certificate/{1}/download".format(base_url, order_id)
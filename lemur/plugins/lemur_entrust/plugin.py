@@ -3,7 +3,7 @@ import requests
 import json
 import sys
 from flask import current_app
-from retrying import retry
+from tenacity import retry, stop_after_attempt, wait_fixed
 from requests.packages.urllib3.util.retry import Retry
 
 from lemur.constants import CRLReason
@@ -88,7 +88,7 @@ def process_options(options, client_id):
     return data
 
 
-@retry(stop_max_attempt_number=5, wait_fixed=1000)
+@retry(stop=stop_after_attempt(5), wait=wait_fixed(1), reraise=True)
 def get_client_id(session, organization):
     """
     Helper function for looking up clientID pased on Organization and parsing the response.
@@ -164,7 +164,7 @@ def handle_response(my_response):
         return data
 
 
-@retry(stop_max_attempt_number=3, wait_fixed=5000)
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(5), reraise=True)
 def order_and_download_certificate(session, url, data):
     """
     Helper function to place a certificacte order and download it
@@ -279,7 +279,7 @@ class EntrustIssuerPlugin(IssuerPlugin):
 
         return cert, chain, external_id
 
-    @retry(stop_max_attempt_number=3, wait_fixed=1000)
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
     def revoke_certificate(self, certificate, reason):
         """Revoke an Entrust certificate."""
         base_url = current_app.config.get("ENTRUST_URL")
@@ -300,7 +300,7 @@ class EntrustIssuerPlugin(IssuerPlugin):
         metrics.send("entrust_revoke_certificate", "counter", 1)
         return handle_response(response)
 
-    @retry(stop_max_attempt_number=3, wait_fixed=1000)
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(1), reraise=True)
     def deactivate_certificate(self, certificate):
         """Deactivates an Entrust certificate, as long as it is still active, and not already deactivcated. """
         log_data = {